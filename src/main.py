@@ -3,9 +3,13 @@ import os
 import asyncio
 import logging
 import csv
+import time
+import concurrent.futures
+import shutil
+import tempfile
+from collections import deque
 from datetime import datetime
 from pathlib import Path
-from io import StringIO
 from typing import List, Dict, Any
 
 # GUI
@@ -14,12 +18,18 @@ from PyQt6.QtWidgets import (
     QWidget, QPushButton, QLineEdit, QTextEdit, QLabel,
     QProgressBar, QFileDialog, QGroupBox, QFormLayout,
     QMessageBox, QTabWidget, QTableWidget, QTableWidgetItem,
-    QInputDialog, QComboBox
+    QInputDialog, QComboBox, QHeaderView
+)
+from PyQt6.QtCore import (
+    QThread, QObject, QRunnable, QThreadPool, QTimer, QEventLoop, QSettings, QMetaObject,
+    pyqtSignal, Qt
 )
-from PyQt6.QtCore import QThread, pyqtSignal, Qt
 
 # Telethon core
-from telethon import TelegramClient, errors, functions, types
+from telethon import TelegramClient, errors, types, utils
+from telethon.sessions import SQLiteSession, StringSession
+from telethon.tl.functions.channels import GetParticipantsRequest
+from telethon.tl.functions.updates import GetStateRequest
 # Explicit TL types
 from telethon.tl import types as tl
 
@@ -34,60 +44,411 @@ ChatParticipantCreator = getattr(tl, 'ChatParticipantCreator', None)
 ChatParticipantAdmin = getattr(tl, 'ChatParticipantAdmin', None)
 ChatParticipantBanned = getattr(tl, 'ChatParticipantBanned', None)
 ChannelParticipantsAdmins = tl.ChannelParticipantsAdmins
+ChannelParticipantsSearch = tl.ChannelParticipantsSearch
 
 import re
 
+# ----------------------------------------------------------------------------
+# Export settings
+# ----------------------------------------------------------------------------
+
+# Сколько последних строк держим в памяти для таблицы результатов;
+# полный результат пишется потоково в CSV.
+PREVIEW_ROWS = 200
+# Сколько строк может ждать писателя CSV и размер буфера файла выгрузки
+CSV_QUEUE_SIZE = 500
+CSV_BUFFER = 1 << 20
+# Участники переводятся в строки пачками
+ROW_BATCH = 1000
+# Колонки, которые выкидываются из выгрузки, если во всех строках стоит заглушка
+OPTIONAL_COLUMNS = {'Last Online': 'Скрыто'}
+
+# ----------------------------------------------------------------------------
+# Link parsing
+# ----------------------------------------------------------------------------
+
+# https://t.me/name, t.me/name/123?single, @name, name
+_LINK_RE = re.compile(r'^(?:https?://)?(?:t\.me/)?@?(?P<name>[^/?#]+)(?:/(?P<msg>\d+)(?=[/?#]|$))?')
+
+
+def parse_tg_link(link: str) -> tuple[str, int | None]:
+    """Split a Telegram link into (username, post id or None)."""
+    m = _LINK_RE.match(link.strip())
+    if not m:
+        return '', None
+    msg = m.group('msg')
+    return m.group('name'), int(msg) if msg else None
+
+
 # ----------------------------------------------------------------------------
 # Helpers for Telethon status mapping
 # ----------------------------------------------------------------------------
 
-def get_user_status_text(status_obj: types.TypeUserStatus | None) -> str:
-    """Return human-readable user status."""
+def format_date(value: datetime) -> str:
+    """Format a Telegram timestamp as 'YYYY-MM-DD HH:MM:SS' (isoformat is cheaper than strftime)."""
+    # Telegram отдаёт время в UTC без микросекунд – отрезаем только смещение «+00:00»
+    return value.isoformat(' ', 'seconds')[:19]
+
+
+_STATUS_MAP: Dict[type, str] = {
+    UserStatusOnline: "Онлайн",
+    UserStatusOffline: "Оффлайн",
+    UserStatusRecently: "Недавно",
+    UserStatusLastWeek: "Был на этой неделе",
+    UserStatusLastMonth: "Был в этом месяце",
+    UserStatusEmpty: "Скрыто",
+}
+
+
+def get_user_status(status_obj: types.TypeUserStatus | None) -> tuple[str, str]:
+    """Return (human-readable status, last-online time or '') in one dispatch."""
     if status_obj is None:
-        return "Скрыто"
-    if isinstance(status_obj, UserStatusOnline):
-        return "Онлайн"
-    if isinstance(status_obj, UserStatusOffline):
-        return "Оффлайн"
-    if isinstance(status_obj, UserStatusRecently):
-        return "Недавно"
-    if isinstance(status_obj, UserStatusLastWeek):
-        return "Был на этой неделе"
-    if isinstance(status_obj, UserStatusLastMonth):
-        return "Был в этом месяце"
-    if isinstance(status_obj, UserStatusEmpty):
-        return "Скрыто"
+        return "Скрыто", ''
+    status_cls = type(status_obj)
+    if status_cls is UserStatusOffline:
+        return "Оффлайн", format_date(status_obj.was_online)
     # Для неизвестных статусов (старых, удалённых) выводим «Давно»
-    return "Давно"
+    return _STATUS_MAP.get(status_cls, "Давно"), ''
+
+
+# ----------------------------------------------------------------------------
+# Session storage
+# ----------------------------------------------------------------------------
+
+# Авторизация хранится строкой StringSession в QSettings, а не файлом .session
+SETTINGS_ORG = "TGpars"
+SETTINGS_APP = "TelegramParser"
+SESSION_KEY = "tg/session"
+# Файлы старой SQLite-сессии (сама база и служебные файлы журнала)
+SESSION_FILE_SUFFIXES = ('.session', '.session-journal', '.session-wal', '.session-shm')
+
+
+def load_session_string(session_name: str) -> str:
+    """Returns the saved StringSession, importing a legacy SQLite session file once."""
+    settings = QSettings(SETTINGS_ORG, SETTINGS_APP)
+    value = settings.value(SESSION_KEY, "", type=str)
+    if not value and os.path.exists(f"{session_name}.session"):
+        legacy = SQLiteSession(session_name)
+        try:
+            value = StringSession.save(legacy)  # '' если ключа авторизации нет
+        finally:
+            legacy.close()
+        if value:
+            settings.setValue(SESSION_KEY, value)
+    return value
+
+
+def save_session_string(client: TelegramClient):
+    """Stores the client's authorization (auth key + DC) in QSettings."""
+    QSettings(SETTINGS_ORG, SETTINGS_APP).setValue(SESSION_KEY, StringSession.save(client.session))
+
+
+def forget_session_string():
+    """Removes the stored authorization from QSettings."""
+    QSettings(SETTINGS_ORG, SETTINGS_APP).remove(SESSION_KEY)
+
+
+def make_client(session_name: str, api_id: int, api_hash: str) -> TelegramClient:
+    """Create a Telethon client with the app's session and flood settings."""
+    # FloodWait обрабатываем сами (_flood_retry), а не молча внутри Telethon
+    return TelegramClient(StringSession(load_session_string(session_name)), api_id, api_hash,
+                          flood_sleep_threshold=0)
+
+
+def make_aux_client(client: TelegramClient, api_id: int, api_hash: str) -> TelegramClient:
+    """Create an extra connection that shares client's authorization (in-memory session)."""
+    # Копия ключа авторизации и DC в StringSession – файлы сессий не плодим
+    return TelegramClient(StringSession(StringSession.save(client.session)), api_id, api_hash,
+                          flood_sleep_threshold=0)
+
+
+# ----------------------------------------------------------------------------
+# Request pacing
+# ----------------------------------------------------------------------------
+
+# Сколько раз подряд пережидаем FloodWait и максимальное ожидание, сек.
+# Ожидание не укорачиваем: повтор раньше срока только продлевает блокировку.
+FLOOD_MAX_RETRIES = 5
+FLOOD_WAIT_CAP = 600
+# Стартовая частота запросов к API (запросов/сек) для адаптивного ограничителя
+API_RATE = 20.0
+# Размер страницы, которую Telethon запрашивает за один вызов в итераторах
+PARTICIPANTS_PAGE = 200
+MESSAGES_PAGE = 100
+# Сколько id резолвим одним запросом при пакетной загрузке отправителей
+ENTITY_BATCH = 200
+# Большие каналы выкачиваем по нескольким соединениям: не больше AUX_CONNECTIONS
+# и не меньше AUX_SLICE участников на соединение
+AUX_CONNECTIONS = 4
+AUX_SLICE = 1000
+
+
+class AdaptiveTokenBucket:
+    """Token bucket whose rate grows additively on success and is cut on FloodWait."""
+
+    def __init__(self, rate: float = API_RATE, min_rate: float = 0.2, max_rate: float = 30.0,
+                 increase: float = 0.5, decrease: float = 0.5):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self._increase = increase
+        self._decrease = decrease
+        self.tokens = max(1.0, rate)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(max(1.0, self.rate), self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def increase_rate(self, delta: float | None = None):
+        self._refill()
+        self.rate = min(self.max_rate, self.rate + (self._increase if delta is None else delta))
+
+    def decrease_rate(self):
+        """Cuts the rate and drops the accumulated burst after a FloodWait."""
+        self._refill()
+        self.rate = max(self.min_rate, self.rate * self._decrease)
+        self.tokens = 0.0
+
+
+# ----------------------------------------------------------------------------
+# Row builders
+# ----------------------------------------------------------------------------
+
+# Кортежи типов для isinstance без отсутствующих в данной сборке Telethon классов
+_CREATOR_TYPES = tuple(t for t in (ChannelParticipantCreator, ChatParticipantCreator) if t)
+_ADMIN_TYPES = tuple(t for t in (ChannelParticipantAdmin, ChatParticipantAdmin) if t)
+_BANNED_TYPES = tuple(t for t in (ChannelParticipantBanned, ChatParticipantBanned) if t)
+
+
+# Порядок колонок выгрузок; строки передаются кортежами в этом же порядке
+MEMBER_HEADERS = (
+    'ID', 'Username', 'First Name', 'Last Name', 'Phone', 'Status', 'Last Online',
+    'Is Bot', 'Is Verified', 'Is Scam', 'Is Premium', 'Is Admin', 'Language',
+    'Has Avatar', 'Chat Member Status', 'Joined Date', 'Custom Title',
+)
+MESSAGE_HEADERS = ('Message ID', 'Author ID', 'Username', 'First Name', 'Last Name', 'Date', 'Text', 'Media Type')
+COMMENT_HEADERS = ('Comment ID', 'Author ID', 'Username', 'First Name', 'Last Name', 'Text', 'Date')
+REACTION_HEADERS = ('Emoji', 'User ID', 'Username', 'First Name', 'Last Name')
+REACTION_SUMMARY_HEADERS = ('Emoji', 'Count', 'Recent User IDs')
+
+
+def member_row(user: types.User, admin_ids: set[int]) -> tuple:
+    """Build the export row (MEMBER_HEADERS order) for a single participant."""
+    status_text, last_online_str = get_user_status(user.status)
+
+    # Participant-specific data
+    participant_obj = getattr(user, 'participant', None)
+    member_status = ''
+    joined_date = ''
+    custom_title = ''
+    if participant_obj:
+        if isinstance(participant_obj, _CREATOR_TYPES):
+            member_status = 'creator'
+        elif isinstance(participant_obj, _ADMIN_TYPES):
+            member_status = 'administrator'
+            custom_title = getattr(participant_obj, 'rank', '') or ''
+        elif isinstance(participant_obj, _BANNED_TYPES):
+            member_status = 'banned'
+        else:
+            member_status = 'member'
+        joined = getattr(participant_obj, 'date', None)
+        if joined:
+            joined_date = format_date(joined)
+
+    return (
+        user.id,
+        user.username or '',
+        user.first_name or '',
+        user.last_name or '',
+        user.phone or '',
+        status_text,
+        last_online_str or 'Скрыто',
+        'Да' if user.bot else 'Нет',
+        'Да' if user.verified else 'Нет',
+        'Да' if user.scam else 'Нет',
+        'Да' if user.premium else 'Нет',
+        'Да' if user.id in admin_ids else 'Нет',
+        getattr(user, 'lang_code', '') or '',
+        'Да' if user.photo else 'Нет',
+        member_status,
+        joined_date,
+        custom_title,
+    )
+
+
+def users_to_rows(users: List[types.User], admin_ids: set[int]) -> List[tuple]:
+    """Converts a batch of participants into MEMBER_HEADERS rows."""
+    return [member_row(user, admin_ids) for user in users]
+
+
+def reaction_rows(reactions: list, users: List[types.User], limit: int) -> List[tuple]:
+    """Joins a reactions list with its users into REACTION_HEADERS rows."""
+    # user_id -> эмодзи; при нескольких реакциях берём первую, как раньше
+    reactions_by_uid: Dict[int, str] = {}
+    for r in reactions:
+        uid = getattr(r.peer_id, 'user_id', None)
+        if uid is not None:
+            reactions_by_uid.setdefault(uid, getattr(r.reaction, 'emoticon', '🧩'))
+    return [(reactions_by_uid.get(user.id, '🧩'), user.id, user.username or '',
+             user.first_name or '', user.last_name or '')
+            for user in users[:limit]]
+
+
+def reaction_summary_rows(reactions) -> List[tuple]:
+    """Builds REACTION_SUMMARY_HEADERS rows from a message's aggregated reactions."""
+    # Недавних реакторов раскладываем по эмодзи за один проход, а не на каждую реакцию
+    recent: Dict[str | None, List[int]] = {}
+    for rr in reactions.recent_reactions or ():
+        user_id = getattr(rr.peer_id, 'user_id', None)
+        if user_id is not None:
+            recent.setdefault(getattr(rr.reaction, 'emoticon', None), []).append(user_id)
+    rows = []
+    for rc in reactions.results:
+        emoji = rc.reaction.emoticon if hasattr(rc.reaction, 'emoticon') else '🧩'
+        rows.append((emoji, rc.count, ','.join(map(str, recent.get(emoji, ())))))
+    return rows
 
 
 # ----------------------------------------------------------------------------
-# Base Thread using Telethon
+# Worker thread (one asyncio loop for all parse jobs)
 # ----------------------------------------------------------------------------
 
-class TelegramParserThread(QThread):
-    """Thread for various Telegram data collection tasks (Telethon)."""
+# Минимальный интервал между сообщениями о прогрессе из потока, сек
+PROGRESS_INTERVAL = 0.25
+# Статусы из задачи уходят в GUI пачкой: по STATUS_BATCH строк или раз в
+# STATUS_FLUSH_INTERVAL сек, смотря что наступит раньше
+STATUS_BATCH = 64
+STATUS_FLUSH_INTERVAL = 0.1
+
+
+class StatusBuffer:
+    """Batches status lines and emits them joined by newlines through signal.
+
+    Lives on the worker loop: the time-based flush is a loop.call_later(), not a QTimer.
+    """
+
+    def __init__(self, signal, loop: asyncio.AbstractEventLoop):
+        self._signal = signal
+        self._loop = loop
+        self._lines: List[str] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    def emit(self, message: str):
+        self._lines.append(message)
+        if len(self._lines) >= STATUS_BATCH:
+            self.flush()
+        elif self._timer is None:
+            self._timer = self._loop.call_later(STATUS_FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._lines:
+            self._signal.emit("\n".join(self._lines))
+            self._lines.clear()
+
+
+class FlushingSignal:
+    """Signal proxy that flushes pending status lines first, keeping messages in order."""
+
+    def __init__(self, signal, status: StatusBuffer):
+        self._signal = signal
+        self._status = status
+
+    def emit(self, *args):
+        self._status.flush()
+        self._signal.emit(*args)
+
+
+class ParserWorker(QThread):
+    """Long-lived thread running the asyncio loop that every parse job shares."""
 
     progress_signal = pyqtSignal(str)
     progress_value = pyqtSignal(int)
-    finished_signal = pyqtSignal(str, list)
+    finished_signal = pyqtSignal(str, list, list, int)
     error_signal = pyqtSignal(str)
     auth_code_needed = pyqtSignal(str)
     auth_password_needed = pyqtSignal()
+    job_done = pyqtSignal()
 
-    def __init__(self, api_id: str, api_hash: str, link: str,
-                 limit: int = 1000, session_name: str | None = None):
+    def __init__(self):
         super().__init__()
-        self.api_id = int(api_id)
+        self.loop = asyncio.new_event_loop()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Schedules a coroutine on the worker loop from any thread."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def shutdown(self, timeout_ms: int = 2000):
+        """Stops the loop and waits for the thread to exit."""
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.wait(timeout_ms)
+
+
+# ----------------------------------------------------------------------------
+# Base parse job using Telethon
+# ----------------------------------------------------------------------------
+
+class TelegramParserJob:
+    """One Telegram data collection run (Telethon), executed on a ParserWorker."""
+
+    def __init__(self, worker: ParserWorker, api_id: int, api_hash: str, link: str,
+                 limit: int = 1000, session_name: str | None = None,
+                 csv_path: str | None = None, client: TelegramClient | None = None):
+        self.worker = worker
+        # Сигналы принадлежат воркеру: GUI подключает их один раз, а не на каждый запуск.
+        # Статусы копятся в буфере; остальные сигналы сперва выталкивают его
+        self.progress_signal = StatusBuffer(worker.progress_signal, worker.loop)
+        self.progress_value = worker.progress_value
+        self.finished_signal = FlushingSignal(worker.finished_signal, self.progress_signal)
+        self.error_signal = FlushingSignal(worker.error_signal, self.progress_signal)
+        self.auth_code_needed = FlushingSignal(worker.auth_code_needed, self.progress_signal)
+        self.auth_password_needed = FlushingSignal(worker.auth_password_needed, self.progress_signal)
+        self.api_id = api_id
         self.api_hash = api_hash
         self.link = link
         self.limit = limit
         self.session_name = session_name or "telegram_parser_session"
-        self.client: TelegramClient | None = None
+        # Клиент может быть общим для всех запусков (см. TelegramParserGUI)
+        self.client: TelegramClient | None = client
+        self._owns_client = client is None
+        self._future: concurrent.futures.Future | None = None
+        self._task: asyncio.Task | None = None
+        self._done = False
         # auth flow
         self.auth_code: str | None = None
         self.auth_password: str | None = None
+        self._loop = worker.loop
+        self._code_event: asyncio.Event | None = None
+        self._password_event: asyncio.Event | None = None
+        self._last_emit = 0.0
+        self._last_pct = 0
+        self._bucket = AdaptiveTokenBucket()
         self.is_running = True
+        # streaming export
+        self.csv_path = csv_path
+        self.rows_written = 0
+        self.headers: List[str] = []
+        self.preview: deque = deque(maxlen=PREVIEW_ROWS)
+        self._rows: asyncio.Queue | None = None
+        self._writer_task: asyncio.Task | None = None
 
     # ---------------------------------------------------------------------
     # Telethon helpers
@@ -96,22 +457,30 @@ class TelegramParserThread(QThread):
     async def ensure_client(self):
         """Creates (if needed) and connects client."""
         if self.client is None:
-            self.client = TelegramClient(self.session_name, self.api_id, self.api_hash)
+            self.client = make_client(self.session_name, self.api_id, self.api_hash)
         if not self.client.is_connected():
             await self.client.connect()
 
     async def ensure_auth(self) -> bool:
-        """Interactive authorization similar to original logic."""
+        """Interactive authorization similar to original logic.
+
+        Uses send_code_request()/sign_in() directly and never client.start(),
+        so Telethon has no reason to prompt on stdin.
+        """
         await self.ensure_client()
-        if await self.client.is_user_authorized():
-            me = await self.client.get_me()
+        if self._code_event is None:
+            # События создаём внутри корутины, чтобы они были привязаны к её циклу
+            self._code_event = asyncio.Event()
+            self._password_event = asyncio.Event()
+        if await self._is_authorized():
+            me = await self._flood_retry(lambda: self.client.get_me())
             self.progress_signal.emit(f"✅ Авторизован как: {me.first_name}")
             return True
 
         # Need phone
+        self._code_event.clear()
         self.auth_code_needed.emit("Введите номер телефона (например: +1234567890)")
-        while self.auth_code is None and self.is_running:
-            await asyncio.sleep(0.1)
+        await self._code_event.wait()
         if not self.is_running:
             return False
         phone = self.auth_code.strip()
@@ -119,38 +488,36 @@ class TelegramParserThread(QThread):
 
         self.progress_signal.emit(f"📤 Отправляем код на {phone}…")
         try:
-            await self.client.send_code_request(phone)
-        except errors.FloodWaitError as e:
-            self.progress_signal.emit(f"⏳ FloodWait: {e.seconds} сек")
-            await asyncio.sleep(e.seconds)
-            return await self.ensure_auth()
+            await self._flood_retry(lambda: self.client.send_code_request(phone))
         except Exception as e:
             self.error_signal.emit(f"❌ Не удалось отправить код: {str(e)}")
             return False
 
         # ask for code
+        self._code_event.clear()
         self.auth_code_needed.emit(f"Введите код из SMS/Telegram для {phone}")
-        while self.auth_code is None and self.is_running:
-            await asyncio.sleep(0.1)
+        await self._code_event.wait()
         if not self.is_running:
             return False
         code = self.auth_code.strip()
         self.auth_code = None
 
         try:
-            await self.client.sign_in(phone=phone, code=code)
+            await self._flood_retry(lambda: self.client.sign_in(phone=phone, code=code))
+            save_session_string(self.client)
             self.progress_signal.emit("✅ Авторизация успешна")
             return True
         except errors.SessionPasswordNeededError:
             # Need 2FA password
             self.progress_signal.emit("🔐 Требуется пароль 2FA…")
+            self._password_event.clear()
             self.auth_password_needed.emit()
-            while self.auth_password is None and self.is_running:
-                await asyncio.sleep(0.1)
+            await self._password_event.wait()
             if not self.is_running:
                 return False
             try:
-                await self.client.sign_in(password=self.auth_password)
+                await self._flood_retry(lambda: self.client.sign_in(password=self.auth_password))
+                save_session_string(self.client)
                 self.progress_signal.emit("✅ Авторизация с 2FA успешна")
                 return True
             except Exception as pwd_error:
@@ -160,30 +527,293 @@ class TelegramParserThread(QThread):
             self.error_signal.emit(f"❌ Ошибка авторизации: {sign_err}")
             return False
 
+    async def _is_authorized(self) -> bool:
+        """Like client.is_user_authorized(), but sleeps out FloodWait.
+
+        Telethon treats any RPC error there (FloodWait included) as "not authorized"
+        and caches it on the client, which would ask a logged-in user to sign in again.
+        """
+        try:
+            await self._flood_retry(lambda: self.client(GetStateRequest()))
+        except errors.FloodWaitError:
+            raise
+        except errors.RPCError:
+            return False
+        return True
+
+    async def _wait_flood(self, e: errors.FloodWaitError, attempt: int,
+                          max_retries: int, cap: int):
+        """Sleeps out a FloodWait, or re-raises it once retries or the cap are exceeded."""
+        seconds = max(e.seconds, 0)
+        if attempt >= max_retries or seconds > cap:
+            raise e
+        self.progress_signal.emit(f"⏳ FloodWait: ожидание {seconds} сек")
+        await asyncio.sleep(seconds + 1)
+
+    async def _invoke(self, coro_factory):
+        """Awaits coro_factory() once it is paced by the token bucket, feeding the outcome back."""
+        await self._bucket.acquire()
+        try:
+            result = await coro_factory()
+        except errors.FloodWaitError:
+            self._bucket.decrease_rate()
+            raise
+        self._bucket.increase_rate()
+        return result
+
+    async def _flood_retry(self, coro_factory, max_retries: int = FLOOD_MAX_RETRIES,
+                           cap: int = FLOOD_WAIT_CAP):
+        """Awaits coro_factory() through _invoke(), retrying after FloodWait."""
+        attempt = 0
+        while True:
+            try:
+                return await self._invoke(coro_factory)
+            except errors.FloodWaitError as e:
+                await self._wait_flood(e, attempt, max_retries, cap)
+                attempt += 1
+
+    async def _iter_flood_safe(self, make_iter, page_size: int,
+                               max_retries: int = FLOOD_MAX_RETRIES, cap: int = FLOOD_WAIT_CAP):
+        """Yields from make_iter(), pacing each page and resuming after FloodWait.
+
+        Telethon's request iterators keep their offset when a chunk request fails,
+        so the same iterator is resumed; it is only re-created if the failure
+        happened before anything was yielded (during its initialisation).
+        """
+        it = make_iter().__aiter__()
+        count = 0
+        attempt = 0
+        while True:
+            # Итератор ходит в API раз в page_size элементов – тогда и берём токен
+            at_page_start = count % page_size == 0
+            if at_page_start:
+                await self._bucket.acquire()
+            try:
+                item = await it.__anext__()
+            except StopAsyncIteration:
+                return
+            except errors.FloodWaitError as e:
+                self._bucket.decrease_rate()
+                await self._wait_flood(e, attempt, max_retries, cap)
+                attempt += 1
+                if not count:
+                    it = make_iter().__aiter__()
+                continue
+            if at_page_start:
+                self._bucket.increase_rate()
+            count += 1
+            attempt = 0
+            yield item
+
+    def _maybe_emit_progress(self, count: int, label: str, total: int | None = None,
+                             force: bool = False):
+        """Emits progress at most every PROGRESS_INTERVAL seconds (or when forced).
+
+        The bar value is a percentage of total (or limit) and is sent only when it changes.
+        """
+        base = total or self.limit
+        pct = min(100, count * 100 // base) if base > 0 else 0
+        if pct != self._last_pct:
+            self._last_pct = pct
+            self.progress_value.emit(pct)
+        now = time.monotonic()
+        if not force and now - self._last_emit < PROGRESS_INTERVAL:
+            return
+        self._last_emit = now
+        self.progress_signal.emit(f"{label}: {count}/{total}" if total else f"{label}: {count}")
+
+    async def resolve_post(self) -> tuple[Any, int] | None:
+        """Resolves self.link as a post link to (chat entity, message id).
+
+        Emits an error and returns None when the link does not point to a post.
+        """
+        name, msg_id = parse_tg_link(self.link)
+        if msg_id is None:
+            self.error_signal.emit("❌ Некорректная ссылка на пост")
+            return None
+        entity = await self._flood_retry(lambda: self.client.get_entity(name))
+        self.progress_signal.emit(f"📄 Канал/чат: {getattr(entity, 'title', name)} | Пост #{msg_id}")
+        return entity, msg_id
+
+    async def resolve_senders(self, messages: List[types.Message]) -> Dict[int, Any]:
+        """Maps sender_id -> sender, fetching uncached senders in batches."""
+        senders: Dict[int, Any] = {}
+        for m in messages:
+            if m.sender is not None:
+                senders[m.sender_id] = m.sender
+        missing = list({m.sender_id for m in messages if m.sender_id is not None} - senders.keys())
+        for i in range(0, len(missing), ENTITY_BATCH):
+            chunk = missing[i:i + ENTITY_BATCH]
+            try:
+                entities = await self._flood_retry(lambda: self.client.get_entity(chunk))
+            except ValueError:
+                # В пачке есть недоступный id – добираем по одному
+                entities = []
+                for peer_id in chunk:
+                    try:
+                        entities.append(await self._flood_retry(lambda: self.client.get_entity(peer_id)))
+                    except ValueError:
+                        entities.append(None)
+            senders.update(zip(chunk, entities))
+        return senders
+
+    # ------------------------------------------------------------------
+    # Streaming CSV export
+    # ------------------------------------------------------------------
+
+    def start_export(self, headers: tuple):
+        """Starts the CSV writer coroutine; rows (tuples in headers order) are fed via push_row()."""
+        self.headers = list(headers)
+        self.rows_written = 0
+        self.preview.clear()
+        self._rows = asyncio.Queue(maxsize=CSV_QUEUE_SIZE)
+        self._writer_task = asyncio.create_task(self._csv_writer(self._rows))
+
+    @staticmethod
+    async def _put_checked(queue: asyncio.Queue, item, consumer: asyncio.Task):
+        """Puts item on queue, re-raising consumer's error if it dies while the queue is full."""
+        if consumer.done():
+            consumer.result()
+        if not queue.full():
+            queue.put_nowait(item)
+            return
+        # Очередь полна: ждём места, но не дольше, чем живёт её потребитель
+        put = asyncio.ensure_future(queue.put(item))
+        try:
+            await asyncio.wait({put, consumer}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            if not put.done():
+                put.cancel()
+        if not put.done() or put.cancelled():
+            consumer.result()
+
+    async def push_row(self, row: tuple):
+        """Queues a row for the CSV writer and keeps it in the rolling preview."""
+        # Писатель может упасть (нет места, нет прав…) – тогда поднимаем его исключение
+        await self._put_checked(self._rows, row, self._writer_task)
+        self.preview.append(row)
+
+    async def finish_export(self, title: str):
+        """Drains the writer and reports headers, the preview and the total row count."""
+        await self._put_checked(self._rows, None, self._writer_task)
+        await self._writer_task
+        if self.is_running:
+            self.finished_signal.emit(title, self.headers, list(self.preview), self.rows_written)
+
+    async def _csv_writer(self, queue: asyncio.Queue):
+        # (индекс колонки, заглушка) для колонок, которые можно выкинуть целиком
+        optional = {self.headers.index(col): placeholder
+                    for col, placeholder in OPTIONAL_COLUMNS.items() if col in self.headers}
+        # Файл читается только после finish_export, поэтому пишем крупным буфером без промежуточных flush
+        f = open(self.csv_path, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER) if self.csv_path else None
+        writer = csv.writer(f) if f else None
+        try:
+            if writer:
+                writer.writerow(self.headers)
+            while True:
+                row = await queue.get()
+                if row is None:
+                    break
+                if writer:
+                    writer.writerow(row)
+                self.rows_written += 1
+                if optional:
+                    for idx in [i for i, placeholder in optional.items() if row[i] != placeholder]:
+                        del optional[idx]
+        finally:
+            if f:
+                f.close()
+
+        if optional and self.rows_written:
+            self._drop_columns(set(optional))
+
+    def _drop_columns(self, indexes: set[int]):
+        """Removes columns from the streamed file and the preview, row by row."""
+        def keep(row):
+            return [v for i, v in enumerate(row) if i not in indexes]
+
+        self.headers = keep(self.headers)
+        self.preview = deque((tuple(keep(row)) for row in self.preview), maxlen=PREVIEW_ROWS)
+        if not self.csv_path:
+            return
+        tmp_path = self.csv_path + ".tmp"
+        with open(self.csv_path, newline='', encoding='utf-8') as src, \
+                open(tmp_path, 'w', newline='', encoding='utf-8', buffering=CSV_BUFFER) as dst:
+            writer = csv.writer(dst)
+            writer.writerows(keep(row) for row in csv.reader(src))
+        os.replace(tmp_path, self.csv_path)
+
     # ------------------------------------------------------------------
     # Cleanup & control
     # ------------------------------------------------------------------
 
     async def cleanup(self):
-        if self.client and self.client.is_connected():
+        if self._writer_task and not self._writer_task.done():
+            self._writer_task.cancel()
+        # Общий клиент остаётся подключённым для следующего запуска
+        if self._owns_client and self.client and self.client.is_connected():
             await self.client.disconnect()
 
+    def start(self):
+        """Submits the job to the worker loop."""
+        self._future = self.worker.submit(self._run())
+
+    def is_active(self) -> bool:
+        # Флаг, а не _future.done(): future разрешается на следующей итерации цикла,
+        # уже после job_done, и GUI увидел бы задачу ещё активной
+        return self._future is not None and not self._done
+
+    async def _run(self):
+        self._task = asyncio.current_task()
+        try:
+            await self.parse()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.progress_signal.flush()
+            self._done = True
+            self.worker.job_done.emit()
+
     def stop(self):
         self.is_running = False
+        # Будим ожидающие ввода корутины, чтобы они увидели остановку
+        self._wake(self._code_event)
+        self._wake(self._password_event)
+        # Отменяем саму задачу: висящий запрос к API прерывается сразу, а не по
+        # таймауту; общий клиент при этом остаётся подключённым
+        if self._task is not None:
+            self._loop.call_soon_threadsafe(self._task.cancel)
+
+    # ------------------------------------------------------------------
+    # Auth input from the GUI thread
+    # ------------------------------------------------------------------
+
+    def provide_auth_code(self, code: str):
+        """Thread-safe: hands the phone number / login code to ensure_auth()."""
+        self.auth_code = code
+        self._wake(self._code_event)
+
+    def provide_auth_password(self, password: str):
+        """Thread-safe: hands the 2FA password to ensure_auth()."""
+        self.auth_password = password
+        self._wake(self._password_event)
+
+    def _wake(self, event: asyncio.Event | None):
+        if event is None or self._loop is None:
+            return
+        try:
+            self._loop.call_soon_threadsafe(event.set)
+        except RuntimeError:
+            pass  # цикл уже закрыт – ждать некому
 
 
 # ----------------------------------------------------------------------------
-# Participants parser thread
+# Participants parser job
 # ----------------------------------------------------------------------------
 
-class MembersParserThread(TelegramParserThread):
-    def __init__(self, api_id, api_hash, chat_link, limit, session_name=None):
-        super().__init__(api_id, api_hash, chat_link, limit, session_name)
-
+class MembersParserJob(TelegramParserJob):
     async def parse(self):
-        old_stdin = sys.stdin
         try:
-            sys.stdin = StringIO("")
             if not self.is_running:
                 return
 
@@ -194,345 +824,404 @@ class MembersParserThread(TelegramParserThread):
             if not self.is_running:
                 return
 
-            chat_username = self._clean_link(self.link)
+            chat_username, _ = parse_tg_link(self.link)
             self.progress_signal.emit(f"🔍 Поиск группы: @{chat_username}")
             try:
-                entity = await self.client.get_entity(chat_username)
+                entity = await self._flood_retry(lambda: self.client.get_entity(chat_username))
             except Exception as e:
                 self.error_signal.emit(f"❌ Не удалось найти группу: {e}")
                 return
 
-            full_chat = await self.client(functions.channels.GetFullChannelRequest(channel=entity)) if isinstance(entity, types.Channel) else None
-            members_count = full_chat.full_chat.participants_count if full_chat else 'Неизвестно'
-            self.progress_signal.emit(f"📊 Группа: {getattr(entity, 'title', '')}")
-            self.progress_signal.emit(f"👥 Участников: {members_count}")
-
-            # Получаем список администраторов, чтобы быстро определять Is Admin
-            admin_ids: set[int] = set()
-            try:
-                async for adm in self.client.iter_participants(entity, filter=ChannelParticipantsAdmins, aggressive=True):
-                    admin_ids.add(adm.id)
-            except Exception:
-                pass  # Если не удалось – оставим список пустым
-
-            # iterate participants
-            members: List[types.User] = []
+            # Отдельный GetFullChannelRequest ради одной строки лога не делаем:
+            # берём participants_count, если Telethon уже положил его в сущность
+            members_count = getattr(entity, 'participants_count', None)
+            expected = min(members_count, self.limit) if members_count else None
+            entity_title = getattr(entity, 'title', '')
+            self.progress_signal.emit(f"📊 Группа: {entity_title}")
+            self.progress_signal.emit(f"👥 Участников: {members_count or '(считаем…)'}")
+
+            async def collect_admins() -> set[int]:
+                try:
+                    return {adm.id async for adm in self._iter_flood_safe(
+                        lambda: self.client.iter_participants(entity, filter=ChannelParticipantsAdmins, aggressive=True),
+                        PARTICIPANTS_PAGE)}
+                except Exception:
+                    return set()  # Если не удалось – оставим список пустым
+
+            # Администраторов (для Is Admin) выкачиваем параллельно с первыми страницами
+            # участников. Сеть складывает сырых пользователей в пачки, строки из пачки
+            # собираются разом и уходят писателю CSV.
+            admins_task = asyncio.create_task(collect_admins())
+            admin_ids: set[int] | None = None
+            self.start_export(MEMBER_HEADERS)
+            push_row = self.push_row
+            emit_progress = self._maybe_emit_progress
+
+            async def submit(batch: List[types.User]):
+                nonlocal admin_ids
+                if admin_ids is None:
+                    admin_ids = await admins_task
+                for row in users_to_rows(batch, admin_ids):
+                    await push_row(row)
+
+            aux_clients = await self._connect_aux(entity)
+            if aux_clients:
+                self.progress_signal.emit(f"🔀 Параллельная загрузка: {len(aux_clients)} соединения")
+                source = self._iter_participants_parallel(entity, aux_clients)
+            else:
+                source = self._iter_flood_safe(lambda: self.client.iter_participants(entity, limit=self.limit, aggressive=True),
+                                               PARTICIPANTS_PAGE)
+            batch: List[types.User] = []
+            count = 0
             try:
-                async for user in self.client.iter_participants(entity, limit=self.limit, aggressive=True):
-                    if not self.is_running:
-                        break
-                    members.append(user)
-
-                    # Небольшая пауза, чтобы снизить нагрузку на API
-                    await asyncio.sleep(0.1)
-
-                    if len(members) % 50 == 0:
-                        self.progress_signal.emit(f"📥 Получено участников: {len(members)}")
-                        self.progress_value.emit(min(len(members), self.limit))
-            except errors.FloodWaitError as e:
-                if self.is_running:
-                    self.progress_signal.emit(f"⏳ FloodWait: ожидание {e.seconds} сек")
-                    await asyncio.sleep(e.seconds)
-                    # Можно попробовать продолжить после паузы (рекурсивно)
-                    # но для простоты завершаем сбор текущим результатом
-
-            parsed_data: List[Dict[str, Any]] = []
-            for idx, user in enumerate(members):
-                if not self.is_running:
-                    break
-                # Формируем last_online
-                last_online_str = ''
-                if isinstance(user.status, UserStatusOffline):
-                    last_online_str = user.status.was_online.strftime("%Y-%m-%d %H:%M:%S")
-
-                # Participant-specific data
-                participant_obj = getattr(user, 'participant', None)
-                member_status = ''
-                joined_date = ''
-                custom_title = ''
-                if participant_obj:
-                    if isinstance(participant_obj, (ChannelParticipantCreator, ChatParticipantCreator)):
-                        member_status = 'creator'
-                    elif isinstance(participant_obj, (ChannelParticipantAdmin, ChatParticipantAdmin)):
-                        member_status = 'administrator'
-                        custom_title = getattr(participant_obj, 'rank', '') or ''
-                    elif isinstance(participant_obj, (ChannelParticipantBanned, ChatParticipantBanned)):
-                        member_status = 'banned'
-                    else:
-                        member_status = 'member'
-                    if hasattr(participant_obj, 'date') and participant_obj.date:
-                        joined_date = participant_obj.date.strftime("%Y-%m-%d %H:%M:%S")
-
-                parsed_data.append({
-                    'ID': user.id,
-                    'Username': user.username or '',
-                    'First Name': user.first_name or '',
-                    'Last Name': user.last_name or '',
-                    'Phone': user.phone or '',
-                    'Status': get_user_status_text(user.status),
-                    'Last Online': last_online_str or 'Скрыто',
-                    'Is Bot': 'Да' if user.bot else 'Нет',
-                    'Is Verified': 'Да' if user.verified else 'Нет',
-                    'Is Scam': 'Да' if user.scam else 'Нет',
-                    'Is Premium': 'Да' if user.premium else 'Нет',
-                    'Is Admin': 'Да' if user.id in admin_ids else 'Нет',
-                    'Language': getattr(user, 'lang_code', '') or '',
-                    'Has Avatar': 'Да' if user.photo else 'Нет',
-                    'Chat Member Status': member_status,
-                    'Joined Date': joined_date,
-                    'Custom Title': custom_title,
-                })
-                if (idx + 1) % 50 == 0:
-                    self.progress_signal.emit(f"🔄 Обработано: {idx + 1}/{len(members)}")
-                    self.progress_value.emit(idx + 1)
-
-            if self.is_running:
-                self.finished_signal.emit(getattr(entity, 'title', ''), parsed_data)
+                try:
+                    async for user in source:
+                        # is_running читаем каждый раз – его меняет stop() из GUI
+                        if not self.is_running:
+                            break
+                        batch.append(user)
+                        count += 1
+                        emit_progress(count, "📥 Получено участников", expected)
+                        if len(batch) >= ROW_BATCH:
+                            await submit(batch)
+                            batch = []
+                except errors.FloodWaitError as e:
+                    # Ждать дольше FLOOD_WAIT_CAP не стали – сохраняем то, что успели собрать
+                    self.progress_signal.emit(f"⚠️ FloodWait {e.seconds} сек – сохраняем собранное")
+                if batch:
+                    await submit(batch)
+            finally:
+                admins_task.cancel()
+                await source.aclose()
+            emit_progress(count, "📥 Получено участников", expected, force=True)
+            self.progress_signal.emit(f"👥 Участников: {count}")
+
+            await self.finish_export(entity_title)
 
         except Exception as e:
             if self.is_running:
                 self.error_signal.emit(f"❌ Критическая ошибка: {e}")
         finally:
-            sys.stdin = old_stdin
             await self.cleanup()
 
-    def _clean_link(self, link: str) -> str:
-        link = link.strip()
-        link = link.replace("https://t.me/", "").replace("t.me/", "")
-        if link.startswith("@"):
-            link = link[1:]
-        if "/" in link:
-            link = link.split("/")[0]
-        if "?" in link:
-            link = link.split("?")[0]
-        return link
-
-    def run(self):
-        asyncio.run(self.parse())
+    async def _connect_aux(self, entity) -> List[TelegramClient]:
+        """Opens extra connections for a large channel; empty list means single-connection mode."""
+        workers = min(AUX_CONNECTIONS, self.limit // AUX_SLICE)
+        if workers < 2 or not isinstance(entity, types.Channel):
+            return []
+        clients: List[TelegramClient] = []
+        try:
+            clients = [make_aux_client(self.client, self.api_id, self.api_hash) for _ in range(workers)]
+            await asyncio.gather(*(c.connect() for c in clients))
+            authorized = await asyncio.gather(*(c.is_user_authorized() for c in clients))
+            if all(authorized):
+                return clients
+        except Exception as e:
+            logging.warning("Доп. соединения недоступны, работаем через одно: %s", e)
+        await asyncio.gather(*(c.disconnect() for c in clients), return_exceptions=True)
+        return []
+
+    async def _fetch_slice(self, client: TelegramClient, channel, start: int, stop: int,
+                           out: asyncio.Queue):
+        """Pages GetParticipantsRequest over offsets [start, stop) and queues users."""
+        offset = start
+        while offset < stop and self.is_running:
+            limit = min(PARTICIPANTS_PAGE, stop - offset)
+            page = await self._flood_retry(lambda: client(GetParticipantsRequest(
+                channel, ChannelParticipantsSearch(''), offset, limit, 0)))
+            users = {user.id: user for user in page.users}
+            for participant in page.participants:
+                user_id = getattr(participant, 'user_id', None)
+                if user_id is None:
+                    # Banned/Left хранят участника в peer
+                    user_id = getattr(getattr(participant, 'peer', None), 'user_id', None)
+                user = users.get(user_id)
+                if user is not None:
+                    # Как в iter_participants: данные участия лежат на пользователе
+                    user.participant = participant
+                    await out.put(user)
+            if len(page.participants) < limit:
+                break
+            offset += limit
+
+    async def _iter_participants_parallel(self, entity, clients: List[TelegramClient]):
+        """Yields channel members fetched by offset slices over several connections.
+
+        Pages may shift while members join or leave, so users are de-duplicated by id.
+        """
+        channel = utils.get_input_channel(entity)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=PARTICIPANTS_PAGE * len(clients))
+        step = -(-self.limit // len(clients))
+        tasks = [asyncio.create_task(self._fetch_slice(client, channel, start, min(start + step, self.limit), queue))
+                 for client, start in zip(clients, range(0, self.limit, step))]
+
+        async def close_when_done():
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await queue.put(None)
+
+        closer = asyncio.create_task(close_when_done())
+        seen: set[int] = set()
+        try:
+            while (user := await queue.get()) is not None:
+                if user.id not in seen:
+                    seen.add(user.id)
+                    yield user
+            for task in tasks:
+                # Ошибку соединения (в т.ч. FloodWait сверх лимита) отдаём наверх
+                task.result()
+        finally:
+            for task in (*tasks, closer):
+                task.cancel()
+            await asyncio.gather(*(c.disconnect() for c in clients), return_exceptions=True)
 
 
 # ----------------------------------------------------------------------------
-# Messages parser thread (recent chat history)
+# Messages parser job (recent chat history)
 # ----------------------------------------------------------------------------
 
-class MessagesParserThread(TelegramParserThread):
-    def __init__(self, api_id, api_hash, chat_link, limit, session_name=None):
-        super().__init__(api_id, api_hash, chat_link, limit, session_name)
-
+class MessagesParserJob(TelegramParserJob):
     async def parse(self):
-        old_stdin = sys.stdin
         try:
-            sys.stdin = StringIO("")
             if not self.is_running:
                 return
             self.progress_signal.emit("🔄 Инициализация клиента…")
             if not await self.ensure_auth():
                 return
-            chat_username = MembersParserThread._clean_link(self, self.link)
-            entity = await self.client.get_entity(chat_username)
-            self.progress_signal.emit(f"💬 Чат: {getattr(entity, 'title', chat_username)}")
+            chat_username, _ = parse_tg_link(self.link)
+            entity = await self._flood_retry(lambda: self.client.get_entity(chat_username))
+            entity_title = getattr(entity, 'title', chat_username)
+            self.progress_signal.emit(f"💬 Чат: {entity_title}")
             self.progress_signal.emit("📥 Получаю сообщения…")
 
             messages: List[types.Message] = []
             try:
-                async for msg in self.client.iter_messages(entity, limit=self.limit):
+                async for msg in self._iter_flood_safe(lambda: self.client.iter_messages(entity, limit=self.limit), MESSAGES_PAGE):
                     if not self.is_running:
                         break
                     messages.append(msg)
-                    await asyncio.sleep(0.05)
-                    if len(messages) % 50 == 0:
-                        self.progress_signal.emit(f"🔄 Получено сообщений: {len(messages)}")
-                        self.progress_value.emit(len(messages))
+                    self._maybe_emit_progress(len(messages), "🔄 Получено сообщений")
             except errors.FloodWaitError as e:
-                self.progress_signal.emit(f"⏳ FloodWait: {e.seconds} сек")
-                await asyncio.sleep(e.seconds)
+                self.progress_signal.emit(f"⚠️ FloodWait {e.seconds} сек – сохраняем собранное")
+            self._maybe_emit_progress(len(messages), "🔄 Получено сообщений", force=True)
 
-            parsed: List[Dict[str, Any]] = []
+            senders = await self.resolve_senders(messages)
+            self.start_export(MESSAGE_HEADERS)
             for m in messages:
-                sender = await m.get_sender()
-                parsed.append({
-                    'Message ID': m.id,
-                    'Author ID': sender.id if sender else '',
-                    'Username': sender.username if sender else '',
-                    'First Name': sender.first_name if sender else '',
-                    'Last Name': sender.last_name if sender else '',
-                    'Date': m.date.strftime("%Y-%m-%d %H:%M:%S"),
-                    'Text': (m.text or m.message or '')[:4096],
-                    'Media Type': type(m.media).__name__ if m.media else ''
-                })
-            if self.is_running:
-                self.finished_signal.emit(f"Сообщения чата {getattr(entity, 'title', chat_username)}", parsed)
+                sender = senders.get(m.sender_id)
+                await self.push_row((
+                    m.id,
+                    sender.id if sender else '',
+                    sender.username if sender else '',
+                    sender.first_name if sender else '',
+                    sender.last_name if sender else '',
+                    format_date(m.date),
+                    (m.text or m.message or '')[:4096],
+                    m.media.__class__.__name__ if m.media else '',
+                ))
+            await self.finish_export(f"Сообщения чата {entity_title}")
         except Exception as e:
             if self.is_running:
                 self.error_signal.emit(f"❌ Критическая ошибка: {e}")
         finally:
-            sys.stdin = old_stdin
             await self.cleanup()
 
-    def run(self):
-        asyncio.run(self.parse())
-
 
 # ----------------------------------------------------------------------------
-# Comments parser thread (replies to post)
+# Comments parser job (replies to post)
 # ----------------------------------------------------------------------------
 
-class CommentsParserThread(TelegramParserThread):
-    def __init__(self, api_id, api_hash, post_link, limit, session_name=None):
-        super().__init__(api_id, api_hash, post_link, limit, session_name)
-
+class CommentsParserJob(TelegramParserJob):
     async def parse(self):
-        old_stdin = sys.stdin
         try:
-            sys.stdin = StringIO("")
             if not self.is_running:
                 return
             self.progress_signal.emit("🔄 Инициализация клиента…")
             if not await self.ensure_auth():
                 return
-            link = self.link.strip().replace("https://t.me/", "").replace("t.me/", "")
-            parts = link.split("/")
-            if len(parts) < 2:
-                self.error_signal.emit("❌ Некорректная ссылка на пост")
+            post = await self.resolve_post()
+            if post is None:
                 return
-            channel_part, msg_id_str = parts[0], parts[1].split("?")[0]
-            msg_id = int(msg_id_str)
-            entity = await self.client.get_entity(channel_part)
-
-            self.progress_signal.emit(f"📄 Канал: {getattr(entity, 'title', channel_part)} | Пост #{msg_id}")
+            entity, msg_id = post
             self.progress_signal.emit("💬 Получаю комментарии…")
             comments: List[types.Message] = []
 
             try:
-                async for reply in self.client.iter_messages(entity, limit=self.limit, reply_to=msg_id):
+                async for reply in self._iter_flood_safe(lambda: self.client.iter_messages(entity, limit=self.limit, reply_to=msg_id),
+                                                         MESSAGES_PAGE):
                     if not self.is_running:
                         break
                     comments.append(reply)
-                    await asyncio.sleep(0.05)
-                    if len(comments) % 50 == 0:
-                        self.progress_signal.emit(f"🔄 Получено комментариев: {len(comments)}")
-                        self.progress_value.emit(min(len(comments), self.limit))
+                    self._maybe_emit_progress(len(comments), "🔄 Получено комментариев")
             except errors.FloodWaitError as e:
-                self.progress_signal.emit(f"⏳ FloodWait: {e.seconds} сек")
-                await asyncio.sleep(e.seconds)
+                self.progress_signal.emit(f"⚠️ FloodWait {e.seconds} сек – сохраняем собранное")
+            self._maybe_emit_progress(len(comments), "🔄 Получено комментариев", force=True)
 
-            parsed: List[Dict[str, Any]] = []
+            senders = await self.resolve_senders(comments)
+            self.start_export(COMMENT_HEADERS)
             for reply in comments:
-                sender = await reply.get_sender()
-                parsed.append({
-                    'Comment ID': reply.id,
-                    'Author ID': sender.id if sender else '',
-                    'Username': sender.username if sender else '',
-                    'First Name': sender.first_name if sender else '',
-                    'Last Name': sender.last_name if sender else '',
-                    'Text': reply.text or reply.message or '',
-                    'Date': reply.date.strftime("%Y-%m-%d %H:%M:%S")
-                })
-            if self.is_running:
-                self.finished_signal.emit(f"Комментарии к посту #{msg_id}", parsed)
+                sender = senders.get(reply.sender_id)
+                await self.push_row((
+                    reply.id,
+                    sender.id if sender else '',
+                    sender.username if sender else '',
+                    sender.first_name if sender else '',
+                    sender.last_name if sender else '',
+                    reply.text or reply.message or '',
+                    format_date(reply.date),
+                ))
+            await self.finish_export(f"Комментарии к посту #{msg_id}")
         except Exception as e:
             if self.is_running:
                 self.error_signal.emit(f"❌ Критическая ошибка: {e}")
         finally:
-            sys.stdin = old_stdin
             await self.cleanup()
 
-    def run(self):
-        asyncio.run(self.parse())
-
 
 # ----------------------------------------------------------------------------
-# Reaction parser thread (simplified)
+# Reaction parser job (simplified)
 # ----------------------------------------------------------------------------
 
-class ReactionsParserThread(TelegramParserThread):
-    def __init__(self, api_id, api_hash, post_link, limit, session_name=None):
-        super().__init__(api_id, api_hash, post_link, limit, session_name)
-
+class ReactionsParserJob(TelegramParserJob):
     async def parse(self):
-        old_stdin = sys.stdin
         try:
-            sys.stdin = StringIO("")
             if not self.is_running:
                 return
             if not await self.ensure_auth():
                 return
-            link = self.link.strip().replace("https://t.me/", "").replace("t.me/", "")
-            parts = link.split("/")
-            if len(parts) < 2:
-                self.error_signal.emit("❌ Неверная ссылка на пост")
+            post = await self.resolve_post()
+            if post is None:
                 return
-            channel_part, msg_id_str = parts[0], parts[1].split("?")[0]
-            msg_id = int(msg_id_str)
-            entity = await self.client.get_entity(channel_part)
-            self.progress_signal.emit(f"📄 Канал/чат: {getattr(entity, 'title', channel_part)} | Пост #{msg_id}")
+            entity, msg_id = post
 
             # fetch reactions list
             from telethon.tl.functions.messages import GetMessageReactionsListRequest
             try:
-                response = await self.client(GetMessageReactionsListRequest(
+                response = await self._flood_retry(lambda: self.client(GetMessageReactionsListRequest(
                     peer=entity,
                     id=msg_id,
                     limit=self.limit,
                     offset=0,
                     reaction=None
-                ))
+                )))
             except Exception as e:
                 # Fallback: агрегированная информация из message.reactions
                 self.progress_signal.emit("ℹ️ Переходим к агрегированному режиму реакций…")
-                message = await self.client.get_messages(entity, msg_id)
+                message = await self._flood_retry(lambda: self.client.get_messages(entity, msg_id))
                 if not message or not message.reactions:
                     self.error_signal.emit(f"ℹ️ У поста нет реакций или недоступно")
                     return
-                agg = []
-                for rc in message.reactions.results:
-                    emoji = rc.reaction.emoticon if hasattr(rc.reaction, 'emoticon') else '🧩'
-                    recent_ids = []
-                    if message.reactions.recent_reactions:
-                        for rr in message.reactions.recent_reactions:
-                            if getattr(rr.reaction, 'emoticon', None) == emoji:
-                                recent_ids.append(rr.peer_id.user_id)
-                    agg.append({'Emoji': emoji, 'Count': rc.count, 'Recent User IDs': ','.join(map(str, recent_ids))})
-                self.finished_signal.emit(f"Реакции поста #{msg_id}", agg)
+                self.start_export(REACTION_SUMMARY_HEADERS)
+                for row in reaction_summary_rows(message.reactions):
+                    await self.push_row(row)
+                await self.finish_export(f"Реакции поста #{msg_id}")
                 return
 
-            parsed: List[Dict[str, Any]] = []
-            for user in response.users:
-                reaction = next((r.reaction.emoticon for r in response.reactions if r.peer_id.user_id == user.id), '🧩')
-                parsed.append({
-                    'Emoji': reaction,
-                    'User ID': user.id,
-                    'Username': user.username or '',
-                    'First Name': user.first_name or '',
-                    'Last Name': user.last_name or ''
-                })
-                if len(parsed) >= self.limit:
-                    break
-            if self.is_running:
-                self.finished_signal.emit(f"Реакции поста #{msg_id}", parsed)
+            self.start_export(REACTION_HEADERS)
+            for row in reaction_rows(response.reactions, response.users, self.limit):
+                await self.push_row(row)
+            await self.finish_export(f"Реакции поста #{msg_id}")
         except Exception as e:
             if self.is_running:
                 self.error_signal.emit(f"❌ Критическая ошибка: {e}")
         finally:
-            sys.stdin = old_stdin
             await self.cleanup()
 
+
+# ----------------------------------------------------------------------------
+# Background file tasks
+# ----------------------------------------------------------------------------
+
+class TaskSignals(QObject):
+    """Carries results of a QRunnable back to the GUI thread."""
+    done = pyqtSignal()
+    failed = pyqtSignal(str)
+
+
+class ClearSessionTask(QRunnable):
+    """Deletes legacy SQLite session files off the GUI thread."""
+
+    def __init__(self, session_name: str):
+        super().__init__()
+        self.session_name = session_name
+        self.signals = TaskSignals()
+
     def run(self):
-        asyncio.run(self.parse())
+        try:
+            # Имена файлов известны заранее – каталог не сканируем вовсе
+            for suffix in SESSION_FILE_SUFFIXES:
+                try:
+                    os.unlink(self.session_name + suffix)
+                except FileNotFoundError:
+                    pass
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+        else:
+            self.signals.done.emit()
 
 
 # ----------------------------------------------------------------------------
 # GUI class – mostly unchanged except threads mapping
 # ----------------------------------------------------------------------------
 
+# По скольким строкам подгоняем ширину колонок (первый экран, а не вся таблица)
+TABLE_RESIZE_ROWS = 50
+# Сколько последних строк держит лог в окне; старые вытесняются, как в кольцевом буфере
+STATUS_MAX_LINES = 2000
+# Как часто GUI применяет накопленные статусы и прогресс, мс (~30 Гц)
+UI_THROTTLE_MS = 33
+
+
 class TelegramParserGUI(QMainWindow):
+    # Режим из выпадающего списка -> (класс задачи, нужна ли ссылка на пост)
+    _WORKERS = {
+        "Участники": (MembersParserJob, False),
+        "Комментарии": (CommentsParserJob, True),
+        "Сообщения": (MessagesParserJob, False),
+        "Реакции": (ReactionsParserJob, True),
+    }
+
     def __init__(self):
         super().__init__()
-        self.parser_thread: TelegramParserThread | None = None
-        self.parsed_data: List[Dict[str, Any]] = []
+        self.parser_job: TelegramParserJob | None = None
+        self.parsed_headers: List[str] = []
+        self.parsed_data: List[tuple] = []
+        # Временный CSV, в который поток пишет результат построчно
+        self.export_path: str | None = None
         self.session_name = "telegram_parser_persistent"
+        # Сообщения и прогресс из потока копятся и применяются не чаще UI_THROTTLE_MS
+        self._pending_status: List[str] = []
+        self._pending_progress: int | None = None
+        self._ui_timer = QTimer(self)
+        self._ui_timer.setSingleShot(True)
+        self._ui_timer.setInterval(UI_THROTTLE_MS)
+        self._ui_timer.timeout.connect(self._flush_ui)
+        # Один поток с циклом asyncio на всё приложение: клиент Telethon и его
+        # соединение переживают отдельные запуски парсинга
+        self.worker = ParserWorker()
+        self.loop = self.worker.loop
+        # Подключённый клиент переживает запуски парсинга и закрывается только
+        # при выходе, очистке сессии или смене API ID/Hash
+        self._tg_client: TelegramClient | None = None
+        self._tg_client_key: tuple | None = None
+        self._clear_task_signals: TaskSignals | None = None
         self.init_ui()
         self.setup_logging()
+        self.connect_worker()
+        self.worker.start()
+
+    def connect_worker(self):
+        """Connects the worker signals once; every parse job emits through them."""
+        # Сигналы всегда приходят из потока воркера, поэтому соединения явно очередные
+        worker = self.worker
+        for signal, slot in (
+            (worker.progress_signal, self.update_status),
+            (worker.progress_value, self.set_progress),
+            (worker.finished_signal, self.parsing_finished),
+            (worker.error_signal, self.parsing_error),
+            (worker.auth_code_needed, self.handle_auth_code),
+            (worker.auth_password_needed, self.handle_auth_password),
+        ):
+            signal.connect(slot, Qt.ConnectionType.QueuedConnection)
 
     # --- UI creation methods copied from original, minimal changes -------------
 
@@ -643,7 +1332,7 @@ class TelegramParserGUI(QMainWindow):
         mode_layout = QHBoxLayout()
         mode_label = QLabel("🛠️ Режим:")
         self.mode_combo = QComboBox()
-        self.mode_combo.addItems(["Участники", "Комментарии", "Сообщения", "Реакции"])
+        self.mode_combo.addItems(list(self._WORKERS))
         mode_layout.addWidget(mode_label)
         mode_layout.addWidget(self.mode_combo)
         mode_layout.addStretch()
@@ -670,6 +1359,7 @@ class TelegramParserGUI(QMainWindow):
         self.status_text = QTextEdit()
         self.status_text.setReadOnly(True)
         self.status_text.setMaximumHeight(180)
+        self.status_text.document().setMaximumBlockCount(STATUS_MAX_LINES)
         progress_layout.addWidget(self.status_text)
         layout.addWidget(progress_group)
         layout.addStretch()
@@ -702,41 +1392,68 @@ class TelegramParserGUI(QMainWindow):
     def setup_logging(self):
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-    def reset_ui_before_start(self, max_value: int):
+    def reset_ui_before_start(self):
         self.start_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
+        self.clear_results_btn.setEnabled(False)
         self.progress_bar.setVisible(True)
-        self.progress_bar.setMaximum(max_value)
+        self.progress_bar.setRange(0, 100)  # задача присылает проценты
         self.progress_bar.setValue(0)
+        self._pending_status.clear()
+        self._pending_progress = None
         self.status_text.clear()
         self.tabs.setCurrentIndex(1)
 
     def reset_ui(self):
         self.start_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
+        self.clear_results_btn.setEnabled(True)
         self.progress_bar.setVisible(False)
         self.progress_bar.setValue(0)
+        self._pending_progress = None
 
     def stop_parsing(self):
-        if self.parser_thread and self.parser_thread.isRunning():
-            self.parser_thread.stop()
+        if self.parser_job and self.parser_job.is_active():
+            self.parser_job.stop()
             self.update_status("⏹️ Остановка…")
-            if not self.parser_thread.wait(5000):
-                self.parser_thread.terminate()
-            self.update_status("✅ Остановлено")
+            if self.wait_parser(5000):
+                self.update_status("✅ Остановлено")
+            else:
+                self.update_status("⚠️ Парсинг не завершился за 5 сек")
         self.reset_ui()
 
     def update_status(self, message: str):
         timestamp = datetime.now().strftime("%H:%M:%S")
-        self.status_text.append(f"[{timestamp}] {message}")
-        cursor = self.status_text.textCursor()
-        cursor.movePosition(cursor.MoveOperation.End)
-        self.status_text.setTextCursor(cursor)
-
-    def parsing_finished(self, title: str, data: List[Dict[str, Any]]):
+        # Задача присылает статусы пачкой, по строке на сообщение
+        self._pending_status.extend(f"[{timestamp}] {line}" for line in message.split("\n"))
+        if not self._ui_timer.isActive():
+            self._ui_timer.start()
+
+    def set_progress(self, value: int):
+        # Важно только последнее значение – промежуточные просто перезаписываем
+        self._pending_progress = value
+        if not self._ui_timer.isActive():
+            self._ui_timer.start()
+
+    def _flush_ui(self):
+        if self._pending_status:
+            # Одна вставка в лог на пачку сообщений
+            self.status_text.append("\n".join(self._pending_status))
+            self._pending_status.clear()
+            cursor = self.status_text.textCursor()
+            cursor.movePosition(cursor.MoveOperation.End)
+            self.status_text.setTextCursor(cursor)
+        if self._pending_progress is not None:
+            self.progress_bar.setValue(self._pending_progress)
+            self._pending_progress = None
+
+    def parsing_finished(self, title: str, headers: List[str], data: List[tuple], total: int):
+        self.parsed_headers = headers
         self.parsed_data = data
-        self.update_status(f"✅ Завершено! Получено {len(data)} записей")
-        self.fill_results_table(data)
+        self.update_status(f"✅ Завершено! Получено {total} записей")
+        if total > len(data):
+            self.update_status(f"ℹ️ В таблице показаны последние {len(data)}, полный результат – в CSV")
+        self.fill_results_table(headers, data)
         self.tabs.setCurrentIndex(2)
         self.reset_ui()
         self.save_csv_btn.setEnabled(True)
@@ -746,136 +1463,236 @@ class TelegramParserGUI(QMainWindow):
         QMessageBox.critical(self, "Ошибка", message)
         self.reset_ui()
 
-    def fill_results_table(self, data: List[Dict[str, Any]]):
+    def fill_results_table(self, headers: List[str], data: List[tuple]):
         if not data:
             return
 
-        headers = list(data[0].keys())
+        # Задача присылает не больше PREVIEW_ROWS строк – отдельный предел не нужен
+        rows = data
+        table = self.results_table
 
-        # Если Last Online везде «Скрыто» – убираем колонку
-        if 'Last Online' in headers and all(item.get('Last Online', 'Скрыто') == 'Скрыто' for item in data):
-            headers.remove('Last Online')
-            for item in data:
-                item.pop('Last Online', None)
+        # Заполняем без перерисовки и сигналов на каждую ячейку
+        table.setSortingEnabled(False)
+        table.setUpdatesEnabled(False)
+        table.blockSignals(True)
+        try:
+            table.setColumnCount(len(headers))
+            table.setRowCount(len(rows))
+            table.setHorizontalHeaderLabels(headers)
+            for row, item in enumerate(rows):
+                for col, value in enumerate(item):
+                    table.setItem(row, col, QTableWidgetItem(str(value)))
+        finally:
+            table.blockSignals(False)
+            table.setUpdatesEnabled(True)
 
-        self.results_table.setColumnCount(len(headers))
-        self.results_table.setRowCount(len(data))
-        self.results_table.setHorizontalHeaderLabels(headers)
-        for row, item in enumerate(data):
-            for col, header in enumerate(headers):
-                self.results_table.setItem(row, col, QTableWidgetItem(str(item.get(header, ''))))
-        self.results_table.resizeColumnsToContents()
+        header_view = table.horizontalHeader()
+        header_view.setSectionResizeMode(QHeaderView.ResizeMode.Interactive)
+        header_view.setResizeContentsPrecision(TABLE_RESIZE_ROWS)
+        table.resizeColumnsToContents()
 
     def save_csv(self):
-        if not self.parsed_data:
+        # Поток уже записал полный результат – просто копируем готовый файл
+        if not self.parsed_data or not self.export_path or not os.path.exists(self.export_path):
             return
 
-        # deep copy to avoid mutating original
-        data = [dict(item) for item in self.parsed_data]
-        headers = list(data[0].keys())
-
-        if 'Last Online' in headers and all(i.get('Last Online', 'Скрыто') == 'Скрыто' for i in data):
-            headers.remove('Last Online')
-            for i in data:
-                i.pop('Last Online', None)
-
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         default_name = f"telegram_parsed_{timestamp}.csv"
         filename, _ = QFileDialog.getSaveFileName(self, "Сохранить CSV", os.path.join(self.save_path_input.text(), default_name), "CSV files (*.csv)")
         if filename:
             try:
-                with open(filename, 'w', newline='', encoding='utf-8') as f:
-                    writer = csv.DictWriter(f, fieldnames=headers)
-                    writer.writeheader()
-                    writer.writerows(data)
+                shutil.copyfile(self.export_path, filename)
                 QMessageBox.information(self, "Успех", f"Файл сохранен: {filename}")
             except Exception as e:
                 QMessageBox.critical(self, "Ошибка", str(e))
 
     def clear_results(self):
+        # Временный CSV открыт писателем активной задачи – его не трогаем
+        if self.parser_job is not None and self.parser_job.is_active():
+            return
+        self.parsed_headers = []
         self.parsed_data = []
         self.results_table.setRowCount(0)
         self.save_csv_btn.setEnabled(False)
+        self.discard_export()
+
+    def discard_export(self):
+        """Удаляет временный CSV предыдущего парсинга."""
+        if self.export_path:
+            try:
+                os.unlink(self.export_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                # Windows не даёт удалить файл, который ещё открыт писателем
+                logging.warning("Не удалось удалить временный CSV %s: %s", self.export_path, e)
+            self.export_path = None
 
     def handle_auth_code(self, message: str):
         code, ok = QInputDialog.getText(self, "Авторизация", message, QLineEdit.EchoMode.Normal)
         if ok and code:
-            self.parser_thread.auth_code = code.strip()
+            self.parser_job.provide_auth_code(code.strip())
         else:
-            self.parser_thread.auth_code = ""
+            self.parser_job.provide_auth_code("")
 
     def handle_auth_password(self):
         pwd, ok = QInputDialog.getText(self, "Пароль 2FA", "Введите пароль:", QLineEdit.EchoMode.Password)
         if ok and pwd:
-            self.parser_thread.auth_password = pwd
+            self.parser_job.provide_auth_password(pwd)
         else:
-            self.parser_thread.auth_password = ""
+            self.parser_job.provide_auth_password("")
 
     def start_parsing(self):
         """Запуск парсинга в выбранном режиме"""
-        if not all([self.api_id_input.text(), self.api_hash_input.text(), self.chat_link_input.text()]):
+        # Повторный клик во время работы ничего не запускает: второй задачи на том же
+        # клиенте и том же файле выгрузки быть не должно
+        if self.parser_job is not None and self.parser_job.is_active():
+            return
+        # Идёт очистка сессии – старые файлы ещё на диске
+        if self._clear_task_signals is not None:
+            return
+        # Читаем поля один раз – дальше работаем с локальными строками
+        api_id = self.api_id_input.text()
+        api_hash = self.api_hash_input.text()
+        link = self.chat_link_input.text().strip()
+        if not all([api_id, api_hash, link]):
             QMessageBox.warning(self, "Ошибка", "Заполните все обязательные поля!")
             return
 
+        try:
+            api_id = int(api_id)
+        except ValueError:
+            QMessageBox.warning(self, "Ошибка", "API ID должен быть числом!")
+            return
+
         try:
             max_items = int(self.max_members_input.text())
         except ValueError:
             QMessageBox.warning(self, "Ошибка", "Введите корректное число!")
             return
 
-        # Останавливаем предыдущий поток, если он активен
-        if self.parser_thread and self.parser_thread.isRunning():
-            self.parser_thread.stop()
-            self.parser_thread.wait(3000)
+        job_cls, needs_post = self._WORKERS[self.mode_combo.currentText()]
+        if needs_post and parse_tg_link(link)[1] is None:
+            QMessageBox.warning(self, "Ошибка", "Ссылка не является ссылкой на пост.")
+            return
 
         # Настройка UI
-        self.reset_ui_before_start(max_items)
-
-        mode = self.mode_combo.currentText()
-        link = self.chat_link_input.text().strip()
-        is_post_link = re.search(r"/\d+(?:\?.*)?$", link) is not None
+        self.reset_ui_before_start()
+        self.save_csv_btn.setEnabled(False)
 
-        if mode == "Комментарии":
-            if not is_post_link:
-                QMessageBox.warning(self, "Ошибка", "Ссылка не является ссылкой на пост.")
-                self.reset_ui()
-                return
-            self.parser_thread = CommentsParserThread(self.api_id_input.text(), self.api_hash_input.text(), link, max_items, self.session_name)
-        elif mode == "Сообщения":
-            self.parser_thread = MessagesParserThread(self.api_id_input.text(), self.api_hash_input.text(), link, max_items, self.session_name)
-        elif mode == "Реакции":
-            if not is_post_link:
-                QMessageBox.warning(self, "Ошибка", "Ссылка не является ссылкой на пост.")
-                self.reset_ui()
-                return
-            self.parser_thread = ReactionsParserThread(self.api_id_input.text(), self.api_hash_input.text(), link, max_items, self.session_name)
-        else:
-            self.parser_thread = MembersParserThread(self.api_id_input.text(), self.api_hash_input.text(), link, max_items, self.session_name)
+        # Новый временный файл для потоковой выгрузки
+        self.discard_export()
+        fd, self.export_path = tempfile.mkstemp(prefix="telegram_parsed_", suffix=".csv")
+        os.close(fd)
 
-        # Подключаем сигналы
-        self.parser_thread.progress_signal.connect(self.update_status)
-        self.parser_thread.progress_value.connect(self.progress_bar.setValue)
-        self.parser_thread.finished_signal.connect(self.parsing_finished)
-        self.parser_thread.error_signal.connect(self.parsing_error)
-        self.parser_thread.auth_code_needed.connect(self.handle_auth_code)
-        self.parser_thread.auth_password_needed.connect(self.handle_auth_password)
+        client = self.get_client(api_id, api_hash)
+        self.parser_job = job_cls(self.worker, api_id, api_hash, link, max_items, self.session_name, self.export_path, client)
 
         # Запуск
-        self.parser_thread.start()
+        self.parser_job.start()
+
+    def wait_parser(self, timeout_ms: int) -> bool:
+        """Waits for the current parse job to finish while still processing UI events."""
+        job = self.parser_job
+        if job is None or not job.is_active():
+            return True
+        loop = QEventLoop()
+        self.worker.job_done.connect(loop.quit)
+        QTimer.singleShot(timeout_ms, loop.quit)
+        # Задача могла завершиться до подключения сигнала – тогда не ждём таймаут
+        if job.is_active():
+            loop.exec()
+        self.worker.job_done.disconnect(loop.quit)
+        return not job.is_active()
 
     def closeEvent(self, event):
-        if self.parser_thread and self.parser_thread.isRunning():
-            self.parser_thread.stop()
-            self.parser_thread.wait(3000)
+        if self.parser_job and self.parser_job.is_active():
+            self.parser_job.stop()
+            self.wait_parser(3000)
+        self.discard_export()
+        disconnect = self.drop_client()
+        if disconnect is not None:
+            # Даём клиенту корректно отключиться до остановки цикла, не блокируя окно
+            self.wait_future(disconnect, 5000)
+        self.worker.shutdown()
         event.accept()
 
+    # --- Persistent Telethon client ------------------------------------------
+
+    def get_client(self, api_id: int, api_hash: str) -> TelegramClient:
+        """Returns the persistent client, recreating it only when the credentials change."""
+        key = (api_id, api_hash, self.session_name)
+        if self._tg_client is not None and self._tg_client_key != key:
+            # Другие API ID/Hash – старый клиент отключаем, чтобы не держать его соединение и авторизацию
+            self.drop_client()
+        if self._tg_client is None:
+            self._tg_client = make_client(self.session_name, api_id, api_hash)
+            self._tg_client_key = key
+        return self._tg_client
+
+    def drop_client(self) -> concurrent.futures.Future | None:
+        """Forgets the persistent client and disconnects it in the background.
+
+        Dropping releases its connection and authorization; the returned future
+        (None if there was no client) resolves once the disconnect is done.
+        """
+        client, self._tg_client, self._tg_client_key = self._tg_client, None, None
+        if client is None:
+            return None
+        future = asyncio.run_coroutine_threadsafe(self._disconnect_client(client), self.loop)
+        future.add_done_callback(self._log_disconnect)
+        return future
+
+    @staticmethod
+    def _log_disconnect(future: concurrent.futures.Future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning("Не удалось отключить клиент Telegram: %s", future.exception())
+
+    @staticmethod
+    def wait_future(future: concurrent.futures.Future, timeout_ms: int) -> bool:
+        """Waits for a worker-loop future while still processing UI events."""
+        loop = QEventLoop()
+        # Колбэк приходит из потока воркера – quit() доставляем очередью
+        future.add_done_callback(
+            lambda _: QMetaObject.invokeMethod(loop, "quit", Qt.ConnectionType.QueuedConnection))
+        QTimer.singleShot(timeout_ms, loop.quit)
+        if not future.done():
+            loop.exec()
+        return future.done()
+
+    @staticmethod
+    async def _disconnect_client(client: TelegramClient):
+        await client.disconnect()
+
     def clear_session(self):
-        try:
-            for file in Path.cwd().glob(f"{self.session_name}*.session*"):
-                file.unlink()
-            QMessageBox.information(self, "Успех", "Сессия очищена. При следующем парсинге потребуется повторная авторизация.")
-        except Exception as e:
-            QMessageBox.warning(self, "Ошибка", f"Не удалось очистить сессию: {e}")
+        if self.parser_job and self.parser_job.is_active():
+            QMessageBox.warning(self, "Ошибка", "Остановите парсинг перед очисткой сессии.")
+            return
+        # Кешированный клиент остаётся авторизованным, пока его не закрыть
+        self.drop_client()
+        forget_session_string()
+        # Старые файлы .session тоже убираем, иначе сессия снова импортируется из них.
+        # Удаление уходит в пул потоков Qt, окно не подвисает на медленном диске
+        task = ClearSessionTask(self.session_name)
+        task.signals.done.connect(self._session_cleared, Qt.ConnectionType.QueuedConnection)
+        task.signals.failed.connect(self._session_clear_failed, Qt.ConnectionType.QueuedConnection)
+        self._clear_task_signals = task.signals  # держим ссылку, пока задача не ответит
+        # Пока файлы не удалены, запуск снова импортировал бы из них сессию
+        self.clear_session_btn.setEnabled(False)
+        self.start_btn.setEnabled(False)
+        QThreadPool.globalInstance().start(task)
+
+    def _session_cleared(self):
+        self.clear_session_btn.setEnabled(True)
+        self.start_btn.setEnabled(True)
+        self._clear_task_signals = None
+        QMessageBox.information(self, "Успех", "Сессия очищена. При следующем парсинге потребуется повторная авторизация.")
+
+    def _session_clear_failed(self, message: str):
+        self.clear_session_btn.setEnabled(True)
+        self.start_btn.setEnabled(True)
+        self._clear_task_signals = None
+        QMessageBox.warning(self, "Ошибка", f"Не удалось очистить сессию: {message}")
 
 
 # ----------------------------------------------------------------------------